@@ -1,160 +1,533 @@
-import json
+import asyncio
 import os
 import random
 import time
-import threading
 import re
-from http.server import BaseHTTPRequestHandler, HTTPServer
+import signal
+import socket
+import sqlite3
+from collections import deque
 from dataclasses import dataclass
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List, Set, Tuple
 
-import requests
-from playwright.sync_api import sync_playwright
-from playwright_stealth import stealth_sync  # 🔥 New Stealth Plugin
+import aiohttp
+import orjson
+from playwright.async_api import async_playwright, TimeoutError as PWTimeoutError
+from selectolax.parser import HTMLParser
+from playwright_stealth import stealth_async  # 🔥 New Stealth Plugin
 
 # Configuration
-URL = "https://www.sheinindia.in/c/sverse-5939-37961"
+URL = os.getenv("URL", "https://www.sheinindia.in/c/sverse-5939-37961")
+# Comma-separated list of pages to watch; all share one browser, one tab each
+URLS = [u.strip() for u in os.getenv("URLS", URL).split(",") if u.strip()]
+# Optional facets JSON endpoints, aligned with URLS by position (blank = none).
+# Find them by running once with LOG_XHR=1, which logs every XHR/fetch a tab makes.
+FACETS_URLS = dict(zip(URLS, (u.strip() for u in os.getenv("FACETS_URLS", "").split(","))))
+LOG_XHR = os.getenv("LOG_XHR", "") == "1"
 TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN", "").strip()
 TELEGRAM_CHAT_ID = os.getenv("TELEGRAM_CHAT_ID", "").strip()
-STATE_FILE = "state.json"
+STATE_DB = os.getenv("STATE_DB", "state.db")
 PORT = int(os.getenv("PORT", "8080"))
+SLEEP_MIN = int(os.getenv("SLEEP_MIN", "60"))
+SLEEP_MAX = int(os.getenv("SLEEP_MAX", "90"))
+# Pre-drawn sleep jitter, cycled through by the main loop
+_JITTERS = tuple(random.randint(SLEEP_MIN, SLEEP_MAX) for _ in range(256))
+BROWSER_RESTART_EVERY = int(os.getenv("BROWSER_RESTART_EVERY", "100"))
+USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/122.0.0.0 Safari/537.36"
+SIDEBAR_SELECTORS = (".S-p-attr-row", ".filter-item", ".attr-item", ".S-p-filter-v2__item")
+
+# Set on SIGTERM/SIGINT; every loop waits on it so shutdown is immediate
+STOP = asyncio.Event()
 
 @dataclass
 class Snapshot:
     ts: float
     men_count: int
     women_count: int
+    selector: Optional[str] = None
+    url: str = URL
+
+# One connection pool shared by Telegram and the HTTP fast path. Created lazily
+# because an aiohttp session belongs to the event loop that first uses it.
+_SESSION: Optional[aiohttp.ClientSession] = None
+
+def _get_session() -> aiohttp.ClientSession:
+    global _SESSION
+    if _SESSION is None:
+        _SESSION = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=4),
+            headers={"User-Agent": USER_AGENT, "Accept-Language": "en-IN"},
+        )
+    return _SESSION
+
+# Alerts are queued and sent by telegram_worker, so the scrape loop never waits
+# on Telegram; when the queue is full new alerts are dropped
+_TG_QUEUE: "asyncio.Queue[str]" = asyncio.Queue(maxsize=64)
+
+async def telegram_worker() -> None:
+    endpoint = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/sendMessage"
+    while True:
+        text = await _TG_QUEUE.get()
+        payload = {"chat_id": TELEGRAM_CHAT_ID, "text": text}
+        try:
+            async with _get_session().post(endpoint, json=payload,
+                                           timeout=aiohttp.ClientTimeout(total=5)) as r:
+                r.raise_for_status()
+        except Exception as e:
+            print(f"Telegram error: {e}", flush=True)
+        finally:
+            _TG_QUEUE.task_done()
 
 def telegram_send(text: str) -> None:
     if not TELEGRAM_BOT_TOKEN or not TELEGRAM_CHAT_ID:
         print(f"[WARN] Telegram creds missing.", flush=True)
         return
-    endpoint = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/sendMessage"
-    payload = {"chat_id": TELEGRAM_CHAT_ID, "text": text}
     try:
-        requests.post(endpoint, json=payload, timeout=15).raise_for_status()
-    except Exception as e:
-        print(f"Telegram error: {e}", flush=True)
-
-def start_health_server():
-    class Handler(BaseHTTPRequestHandler):
-        def do_GET(self):
-            self.send_response(200)
-            self.end_headers()
-            self.wfile.write(b"ok")
-        def log_message(self, format, *args):
-            return 
-
-    server = HTTPServer(("0.0.0.0", PORT), Handler)
+        _TG_QUEUE.put_nowait(text)
+    except asyncio.QueueFull:
+        print("[WARN] Telegram queue full, alert dropped.", flush=True)
+
+# Canned reply for Railway probes; request contents are never inspected
+HEALTH_RESPONSE = (b"HTTP/1.1 200 OK\r\nContent-Type: text/plain\r\nContent-Length: 2\r\n"
+                   b"Connection: keep-alive\r\n\r\nok")
+# Open probe connections, closed on shutdown so wait_closed() doesn't hang on them
+_PROBE_WRITERS: Set[asyncio.StreamWriter] = set()
+
+async def _answer_probe(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    """Replies once per request on a kept-alive connection until the client hangs up."""
+    _PROBE_WRITERS.add(writer)
+    try:
+        while True:
+            # Consume the whole request head so each request gets exactly one reply
+            await reader.readuntil(b"\r\n\r\n")
+            writer.write(HEALTH_RESPONSE)
+            await writer.drain()
+    except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, OSError):
+        pass
+    finally:
+        _PROBE_WRITERS.discard(writer)
+        writer.close()
+
+async def start_health_server():
+    """Serves health probes on the watcher's event loop until STOP is set."""
+    server = await asyncio.start_server(
+        _answer_probe, "0.0.0.0", PORT, backlog=128, reuse_address=True,
+        # Lets a redeployed instance bind while the old one is still draining
+        reuse_port=hasattr(socket, "SO_REUSEPORT"),
+    )
     print(f"✅ Health server active on port {PORT}", flush=True)
-    server.serve_forever()
+    async with server:
+        await STOP.wait()
+        for writer in list(_PROBE_WRITERS):
+            writer.close()
+
+# State lives in SQLite (WAL): each save appends a small log record instead of
+# rewriting a file, and a crash mid-write can never leave it half-written
+_DB: Optional[sqlite3.Connection] = None
+# What was last persisted per URL, so unchanged ticks never touch the disk
+_LAST_SAVED: Dict[str, Tuple[int, int, Optional[str]]] = {}
+
+def _db() -> sqlite3.Connection:
+    global _DB
+    if _DB is None:
+        _DB = sqlite3.connect(STATE_DB, isolation_level=None)
+        _DB.execute("PRAGMA journal_mode=WAL")
+        _DB.execute("CREATE TABLE IF NOT EXISTS state(k TEXT PRIMARY KEY, v TEXT)")
+    return _DB
 
 def load_state() -> Optional[Dict[str, Any]]:
-    if not os.path.exists(STATE_FILE): return None
+    """Returns the last saved snapshot of every watched URL, keyed by URL."""
     try:
-        with open(STATE_FILE, "r", encoding="utf-8") as f:
-            return json.load(f)
-    except: return None
-
-def save_state(snap: Snapshot) -> None:
-    data = {"ts": snap.ts, "men_count": snap.men_count, "women_count": snap.women_count}
-    with open(STATE_FILE, "w", encoding="utf-8") as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
-
-def extract_number(text: str) -> int:
-    """Extracts '54' from strings like 'Women (54)'"""
-    match = re.search(r'\((\d+)\)', text)
-    return int(match.group(1)) if match else 0
-
-def scrape_snapshot() -> Snapshot:
-    os.environ["PLAYWRIGHT_BROWSERS_PATH"] = "/app/pw-browsers"
-    with sync_playwright() as p:
-        browser = p.chromium.launch(
-            headless=True, 
-            args=["--no-sandbox", "--disable-dev-shm-usage", "--disable-gpu", "--single-process"]
-        )
-        # Use a real Desktop viewport
-        context = browser.new_context(
-            viewport={'width': 1920, 'height': 1080},
-            user_agent="Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/122.0.0.0 Safari/537.36"
-        )
-        page = context.new_page()
-        
-        # 🔥 Enable Stealth Mode to bypass bot detection
-        stealth_sync(page) 
-        
-        print(f"Scraping counts from {URL}...", flush=True)
-        men_count = 0
-        women_count = 0
-        
+        rows = _db().execute("SELECT k, v FROM state").fetchall()
+    except sqlite3.Error: return None
+    state: Dict[str, Any] = {}
+    for k, v in rows:
         try:
-            page.goto(URL, wait_until="networkidle", timeout=60000)
-            # Give extra time for JS categories to load
-            page.wait_for_timeout(5000) 
-
-            # Strategy 1: Look for specific sidebar selectors
-            selectors = [".S-p-attr-row", ".filter-item", ".S-p-filter-v2__item"]
-            for sel in selectors:
-                rows = page.locator(sel)
-                if rows.count() > 0:
-                    for i in range(rows.count()):
-                        row_text = rows.nth(i).inner_text()
-                        if "Women" in row_text: women_count = extract_number(row_text)
-                        elif "Men" in row_text: men_count = extract_number(row_text)
-                    if women_count > 0 or men_count > 0: break
-
-            # Strategy 2: Fallback - Search the entire page source if sidebar is hidden
-            if men_count == 0 and women_count == 0:
-                print("DEBUG: Sidebar missing. Searching full page content...", flush=True)
-                content = page.content()
-                # Find patterns like "Men (2)" or "Women (54)" anywhere in the text
-                m_match = re.search(r'Men\s*\((\d+)\)', content)
-                w_match = re.search(r'Women\s*\((\d+)\)', content)
-                if m_match: men_count = int(m_match.group(1))
-                if w_match: women_count = int(w_match.group(1))
+            state[k] = orjson.loads(v)
+        except ValueError:
+            # A corrupt row only costs that URL its baseline, not the whole watcher
+            print(f"Skipping unreadable state for {k}", flush=True)
+    return state or None
 
-        except Exception as e:
-            print(f"Scrape Error: {e}", flush=True)
-        finally:
-            browser.close()
-            
-        return Snapshot(ts=time.time(), men_count=men_count, women_count=women_count)
+def state_of(snaps: List[Snapshot]) -> Dict[str, Any]:
+    """Maps snapshots to the per-URL dicts that load_state returns."""
+    return {
+        snap.url: {"ts": snap.ts, "men_count": snap.men_count, "women_count": snap.women_count,
+                   "last_selector": snap.selector}
+        for snap in snaps
+    }
+
+def save_state(snaps: List[Snapshot]) -> None:
+    """Upserts one row per URL in a single transaction, skipping unchanged state."""
+    global _LAST_SAVED
+    saved = {snap.url: (snap.men_count, snap.women_count, snap.selector) for snap in snaps}
+    if saved == _LAST_SAVED: return
+    data = state_of(snaps)
+    con = _db()
+    con.execute("BEGIN")
+    try:
+        con.executemany("INSERT OR REPLACE INTO state VALUES(?, ?)",
+                        [(url, orjson.dumps(v).decode()) for url, v in data.items()])
+        con.execute("COMMIT")
+    except sqlite3.Error:
+        con.execute("ROLLBACK")
+        raise
+    _LAST_SAVED = saved
+
+def _first_counts(pattern: re.Pattern, text: str) -> Tuple[int, int]:
+    """Returns (men, women) from the first match of each label in `text`"""
+    counts: Dict[str, int] = {}
+    for label, n in pattern.findall(text):
+        counts.setdefault(label, int(n))
+    return counts.get("Men", 0), counts.get("Women", 0)
+
+# Matches 'Women (54)' or 'Men\n(2)' in sidebar text, but not 'Menu' or 'Women's Tops (120)'
+_SIDEBAR_COUNT = re.compile(r'\b(Women|Men)\b\s*\((\d+)\)')
+
+def counts_from_sidebar(text: str) -> Tuple[int, int]:
+    """Picks the Men/Women counts out of the sidebar's text in one regex pass"""
+    return _first_counts(_SIDEBAR_COUNT, text)
+
+# In raw HTML the label and its count are often split by markup, e.g.
+# "Men</span><span>(2)", so allow tags and whitespace (only) between them
+_LABEL_COUNT = re.compile(r'\b(Women|Men)\b(?:\s|<[^>]*>){0,10}\((\d+)\)')
+
+def counts_from_html(content: str) -> Tuple[int, int]:
+    """Finds patterns like "Men (2)" or "Women (54)" anywhere in the text"""
+    return _first_counts(_LABEL_COUNT, content)
+
+def counts_from_json(node: Any) -> Tuple[int, int]:
+    """Walks a facets payload for entries like {"name": "Men", "count": 2}"""
+    counts: Dict[str, int] = {}
+    # FIFO so entries are visited in document order and the first match wins
+    queue = deque([node])
+    while queue:
+        item = queue.popleft()
+        if isinstance(item, list):
+            queue.extend(item)
+        elif isinstance(item, dict):
+            label = next((v for v in item.values() if v in ("Men", "Women")), None)
+            if label:
+                for k, v in item.items():
+                    if isinstance(v, (int, str)) and str(v).isdigit() and \
+                            ("count" in k.lower() or "num" in k.lower()):
+                        counts.setdefault(label, int(v))
+                        break
+            queue.extend(item.values())
+    return counts.get("Men", 0), counts.get("Women", 0)
+
+async def scrape_facets(api_url: str) -> Optional[Tuple[int, int]]:
+    """Fastest path: reads the counts straight from the site's facets XHR."""
+    try:
+        async with _get_session().get(api_url, timeout=aiohttp.ClientTimeout(total=15)) as r:
+            r.raise_for_status()
+            payload = await r.json(content_type=None)
+    except Exception as e:
+        print(f"Facets API error: {e}", flush=True)
+        return None
+    counts = counts_from_json(payload)
+    return counts if any(counts) else None
+
+# Per URL: conditional-request headers from the last good response and the
+# counts parsed from it, reused as-is when the server answers 304 Not Modified
+_HTTP_CACHE: Dict[str, Tuple[Dict[str, str], Tuple[int, int]]] = {}
 
-def main_loop():
+async def scrape_http(url: str) -> Optional[Tuple[int, int]]:
+    """Fast path: reads the counts from the server-rendered HTML, no browser."""
+    if FACETS_URLS.get(url):
+        counts = await scrape_facets(FACETS_URLS[url])
+        if counts: return counts
+    cached = _HTTP_CACHE.get(url)
+    try:
+        async with _get_session().get(url, headers=cached[0] if cached else None,
+                                      timeout=aiohttp.ClientTimeout(total=15)) as r:
+            if r.status == 304 and cached:
+                return cached[1]
+            r.raise_for_status()
+            html = await r.text()
+            validators = {h: r.headers[k] for h, k in (("If-None-Match", "ETag"),
+                                                       ("If-Modified-Since", "Last-Modified"))
+                          if k in r.headers}
+    except Exception as e:
+        print(f"HTTP fast path error: {e}", flush=True)
+        return None
+    # Parse the sidebar rows in-process; fall back to a raw text search
+    rows = HTMLParser(html).css(", ".join(SIDEBAR_SELECTORS))
+    counts = counts_from_sidebar("\n".join(node.text(strip=True) for node in rows))
+    if not any(counts):
+        counts = counts_from_html(html)
+    if any(counts) and validators:
+        _HTTP_CACHE[url] = (validators, counts)
+    else:
+        _HTTP_CACHE.pop(url, None)
+    return counts if any(counts) else None
+
+# Persistent browser: launched once and reused across checks
+_BROWSER_LOCK = asyncio.Lock()
+_PW = None
+_BROWSER = None
+_CONTEXT = None
+# One warm tab per URL, kept across ticks so DNS, connections and V8 caches stay hot
+_PAGES: Dict[str, Any] = {}
+_ITER_COUNT = 0
+_BROWSER_FAILED = False
+
+# Only the DOM text is read, so these resources are never needed
+BLOCKED_RESOURCE_TYPES = {"image", "font", "media", "stylesheet"}
+# Trackers and ad pixels, blocked whatever their resource type
+BLOCKED_URL_PARTS = ("google-analytics", "googletagmanager", "doubleclick", "facebook")
+
+# Injected before any page script: stubs beacons, idle work and third-party fetches
+# so analytics and recommender code stop churning the renderer
+_QUIET_JS = """(() => {
+    navigator.sendBeacon = () => true;
+    window.requestIdleCallback = () => 0;
+    const site = location.hostname.replace(/^www\\./, '');
+    const origFetch = window.fetch;
+    window.fetch = (u, o) => {
+        let url;
+        try { url = new URL(u instanceof Request ? u.url : String(u), location.href); }
+        catch (e) { return origFetch(u, o); }
+        // Only third-party http(s) calls; blob:/data: and first-party go through
+        if (/^https?:$/.test(url.protocol) && !url.hostname.endsWith(site))
+            return Promise.resolve(new Response('{}'));
+        return origFetch(u, o);
+    };
+})();"""
+
+# Runs in-page and returns [selector, sidebar text] for the first selector whose
+# rows mention Men/Women, so later selectors are never evaluated on a hit
+_SIDEBAR_JS = """(sels) => {
+    for (const s of sels) {
+        const texts = Array.from(document.querySelectorAll(s), e => (e.innerText || '').trim());
+        if (texts.some(t => t.includes('Men') || t.includes('Women'))) return [s, texts.join('\\n')];
+    }
+    return [null, ''];
+}"""
+
+async def _block_heavy_resources(route) -> None:
+    request = route.request
+    if request.resource_type in BLOCKED_RESOURCE_TYPES or \
+            any(part in request.url for part in BLOCKED_URL_PARTS):
+        await route.abort()
+    else:
+        await route.continue_()
+
+async def _get_context():
+    """Lazily launches Chromium and returns the shared browser context."""
+    global _PW, _BROWSER, _CONTEXT
+    if _CONTEXT is None:
+        os.environ["PLAYWRIGHT_BROWSERS_PATH"] = "/app/pw-browsers"
+        _PW = await async_playwright().start()
+        try:
+            _BROWSER = await _PW.chromium.launch(
+                headless=True, 
+                args=["--no-sandbox", "--disable-dev-shm-usage", "--disable-gpu",
+                      "--disable-extensions", "--disable-background-networking",
+                      "--disable-default-apps", "--no-first-run",
+                      "--disable-features=Translate,BackForwardCache",
+                      "--disable-accelerated-2d-canvas", "--blink-settings=imagesEnabled=false",
+                      "--js-flags=--max-old-space-size=256"]
+            )
+            # Desktop width keeps the filter sidebar laid out; a short viewport keeps
+            # layout/paint/raster work (which scales with area) small
+            _CONTEXT = await _BROWSER.new_context(
+                viewport={'width': 1280, 'height': 600},
+                device_scale_factor=1,
+                is_mobile=False,
+                user_agent=USER_AGENT
+            )
+            await _CONTEXT.route("**/*", _block_heavy_resources)
+            await _CONTEXT.add_init_script(_QUIET_JS)
+        except BaseException:
+            # Don't leave a Playwright driver (or half-built browser) running
+            await _close_browser()
+            raise
+    return _CONTEXT
+
+async def _close_browser() -> None:
+    """Tears down the shared browser so the next check re-launches it."""
+    global _PW, _BROWSER, _CONTEXT, _ITER_COUNT, _BROWSER_FAILED
+    try:
+        if _BROWSER: await _BROWSER.close()
+    except Exception as e:
+        print(f"Browser close error: {e}", flush=True)
+    # Separate try: a dead browser connection must not leave the driver running
+    try:
+        if _PW: await _PW.stop()
+    except Exception as e:
+        print(f"Playwright stop error: {e}", flush=True)
+    _PW = _BROWSER = _CONTEXT = None
+    _PAGES.clear()
+    _ITER_COUNT = 0
+    _BROWSER_FAILED = False
+
+def _log_xhr(request) -> None:
+    if request.resource_type in ("xhr", "fetch"):
+        print(f"XHR: {request.method} {request.url}", flush=True)
+
+async def _drop_page(url: str) -> None:
+    """Closes a URL's tab so the next tick opens a fresh one."""
+    page = _PAGES.pop(url, None)
+    try:
+        if page: await page.close()
+    except Exception:
+        pass
+
+async def scrape_snapshot(url: str, preferred: Optional[str] = None) -> Snapshot:
+    """Reads one URL: HTTP fast path first, then a tab in the shared browser."""
+    global _BROWSER_FAILED
+    counts = await scrape_http(url)
+    if counts:
+        print(f"Counts read from HTML at {url}", flush=True)
+        return Snapshot(ts=time.time(), men_count=counts[0], women_count=counts[1],
+                        selector=preferred, url=url)
+
+    print(f"Scraping counts from {url}...", flush=True)
+    men_count = 0
+    women_count = 0
+    selector = None
+    
+    try:
+        # Inside the try: a failed launch is this URL's error, not one that
+        # tears down the gather while sibling tabs are still using the browser
+        async with _BROWSER_LOCK:
+            context = await _get_context()
+        page = _PAGES.get(url)
+        if page is None:
+            page = _PAGES[url] = await context.new_page()
+            if LOG_XHR: page.on("request", _log_xhr)
+            # 🔥 Enable Stealth Mode to bypass bot detection
+            await stealth_async(page) 
+
+        # Return as soon as the response starts, then wait only for the sidebar
+        await page.goto(url, wait_until="commit", timeout=30000)
+        try:
+            await page.wait_for_selector(", ".join(SIDEBAR_SELECTORS), timeout=15000)
+        except PWTimeoutError:
+            # Sidebar never rendered: let the page finish loading once before the
+            # fallbacks. Not networkidle: ad/analytics long-polls keep it from firing.
+            try:
+                await page.wait_for_load_state("load", timeout=15000)
+            except PWTimeoutError:
+                pass
+
+        # Strategy 1: Read the sidebar in one evaluate, trying last run's selector first
+        order = [preferred] if preferred in SIDEBAR_SELECTORS else []
+        order += [sel for sel in SIDEBAR_SELECTORS if sel != preferred]
+        selector, text = await page.evaluate(_SIDEBAR_JS, order)
+        men_count, women_count = counts_from_sidebar(text)
+
+        # Strategy 2: Fallback - Search the entire page source if sidebar is hidden
+        if men_count == 0 and women_count == 0:
+            print("DEBUG: Sidebar missing. Searching full page content...", flush=True)
+            men_count, women_count = counts_from_html(await page.content())
+
+    except PWTimeoutError as e:
+        # A stuck navigation only poisons this tab, not the whole browser
+        print(f"Scrape Timeout ({url}): {e}", flush=True)
+        await _drop_page(url)
+    except Exception as e:
+        print(f"Scrape Error ({url}): {e}", flush=True)
+        await _drop_page(url)
+        _BROWSER_FAILED = True
+
+    return Snapshot(ts=time.time(), men_count=men_count, women_count=women_count,
+                    selector=selector, url=url)
+
+async def scrape_all(prev_state: Dict[str, Any]) -> List[Snapshot]:
+    """Scrapes every watched URL concurrently, one tab each in the shared browser."""
+    global _ITER_COUNT, _BROWSER_FAILED
+    try:
+        return await asyncio.gather(*[
+            scrape_snapshot(url, prev_state.get(url, {}).get("last_selector")) for url in URLS
+        ])
+    except Exception:
+        _BROWSER_FAILED = True
+        raise
+    finally:
+        # Recycle Chromium periodically (and after errors) to cap leak growth
+        if _PW is not None:
+            _ITER_COUNT += 1
+            if _BROWSER_FAILED or _ITER_COUNT >= BROWSER_RESTART_EVERY:
+                await _close_browser()
+        else:
+            # A launch that failed already cleaned up after itself
+            _BROWSER_FAILED = False
+
+async def _stopped_within(seconds: float) -> bool:
+    """Sleeps for up to `seconds`; True as soon as STOP is set."""
+    try:
+        await asyncio.wait_for(STOP.wait(), seconds)
+    except asyncio.TimeoutError:
+        return False
+    return True
+
+async def main_loop():
     print("⏳ Starting in 15s...", flush=True)
-    time.sleep(15)
+    if await _stopped_within(15): return
     telegram_send("✅ SHEIN Stealth Watcher active.")
+    # Read from disk once; this process is the only writer, so afterwards the
+    # previous tick's snapshots are the source of truth
+    prev_state = load_state() or {}
+    tick = 0
     
     while True:
         try:
-            prev = load_state()
-            curr = scrape_snapshot()
+            snaps = await scrape_all(prev_state)
             
-            if prev:
-                pm, pw = int(prev.get("men_count", 0)), int(prev.get("women_count", 0))
-                dm, dw = curr.men_count - pm, curr.women_count - pw
-
-                if dm != 0 or dw != 0:
-                    mi = "⬆️" if dm > 0 else "⬇️"
-                    wi = "⬆️" if dw > 0 else "⬇️"
-                    
-                    msg = (
-                        "🔔 Shein Stock Update\n\n"
-                        f"👨 Men → {curr.men_count} {mi} {dm:+d}\n"
-                        f"👩 Women → {curr.women_count} {wi} {dw:+d}\n\n"
-                        f"⏰ {time.strftime('%d %b %Y, %I:%M %p')}\n\n"
-                        f"Direct Link: {URL}"
-                    )
-                    telegram_send(msg)
+            for curr in snaps:
+                prev = prev_state.get(curr.url)
+                if prev:
+                    pm, pw = int(prev.get("men_count", 0)), int(prev.get("women_count", 0))
+                    dm, dw = curr.men_count - pm, curr.women_count - pw
+
+                    if dm != 0 or dw != 0:
+                        mi = "⬆️" if dm > 0 else "⬇️"
+                        wi = "⬆️" if dw > 0 else "⬇️"
+                        
+                        msg = (
+                            "🔔 Shein Stock Update\n\n"
+                            f"👨 Men → {curr.men_count} {mi} {dm:+d}\n"
+                            f"👩 Women → {curr.women_count} {wi} {dw:+d}\n\n"
+                            f"⏰ {time.strftime('%d %b %Y, %I:%M %p')}\n\n"
+                            f"Direct Link: {curr.url}"
+                        )
+                        telegram_send(msg)
+                print(f"Update: Men({curr.men_count}) Women({curr.women_count}) {curr.url}", flush=True)
             
-            save_state(curr)
-            print(f"Update: Men({curr.men_count}) Women({curr.women_count})", flush=True)
+            # Advance in memory first: a failing disk must not re-alert the same delta
+            prev_state = state_of(snaps)
+            try:
+                save_state(snaps)
+            except sqlite3.Error as e:
+                print(f"State save error: {e}", flush=True)
         except Exception as e:
             print(f"Loop Error: {e}", flush=True)
         
         # 🔥 Slow down slightly to avoid instant IP bans
-        time.sleep(random.randint(60, 90))
+        if await _stopped_within(_JITTERS[tick & 255]): break
+        tick += 1
+
+    # Shut Chromium down cleanly so a redeploy never leaks the browser
+    await _close_browser()
+    if _DB: _DB.close()
+
+async def main():
+    """Runs the watcher and the health server together on one event loop."""
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, STOP.set)
+    worker = asyncio.create_task(telegram_worker())
+    await asyncio.gather(main_loop(), start_health_server())
+
+    # Give queued alerts a moment to go out before the session closes
+    try:
+        await asyncio.wait_for(_TG_QUEUE.join(), 5)
+    except asyncio.TimeoutError:
+        pass
+    worker.cancel()
+    if _SESSION: await _SESSION.close()
 
 if __name__ == "__main__":
-    threading.Thread(target=main_loop, daemon=True).start()
-    start_health_server()
\ No newline at end of file
+    asyncio.run(main())
\ No newline at end of file